@@ -1,140 +1,495 @@
 import os
-import traceback
+import time
+import random
+import hashlib
+import hmac
+import secrets
+import threading
 import logging
+from collections import namedtuple
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
-from dotenv import load_dotenv
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException
 import ccxt
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    MEXC_API_KEY,
+    MEXC_API_SECRET,
+    USE_TESTNET,
+    DEFAULT_LEVERAGE,
+    MARKETS_TTL,
+    BALANCE_TTL,
+    TICKER_TTL,
+    EXCHANGE_TIMEOUT_MS,
+    ORDER_WORKERS,
+    GUNICORN_THREADS,
+    WEBHOOK_SECRET,
+    MAX_BODY_BYTES,
+)
 
-load_dotenv()
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
-MEXC_API_KEY = os.getenv("MEXC_API_KEY")
-MEXC_API_SECRET = os.getenv("MEXC_API_SECRET")
-USE_TESTNET = os.getenv("USE_TESTNET", "False").lower() in ("true", "1", "yes")
-DEFAULT_LEVERAGE = int(os.getenv("LEVERAGE", "25"))
-
-if not MEXC_API_KEY or not MEXC_API_SECRET:
-    raise RuntimeError("MEXC_API_KEY veya MEXC_API_SECRET eksik")
-
-def normalize_symbol(symbol, exchange):
-    symbol = symbol.upper()
-    exchange.load_markets()
-
-    swap_symbols = [
-        s for s in exchange.symbols
-        if exchange.market(s).get('type') == 'swap'
-    ]
-    logger.info(f"[DEBUG] {len(swap_symbols)} swap sembol bulundu.")
-
-    candidates = [
-        symbol + "USDT",
-        symbol + "USD",
-        symbol + "_USDT",
-        symbol + "/USDT:USDT",
-        symbol + "/USDT:SWAP",
-        symbol + "/USDT",
-        symbol + "_USDT:USDT",
-        symbol + "_USDT:SWAP"
-    ]
-
-    matches = [s for s in candidates if s in swap_symbols]
-    logger.info(f"[MATCHES] Denenen semboller: {candidates}")
-    if matches:
-        logger.info(f"[SYMBOL] Kullanılan sembol: {matches[0]}")
-        return matches[0]
-
-    raise ValueError(f"[SYMBOL] Sembol bulunamadı: {candidates}")
-
-def place_mexc_futures_order(exchange, normalized_symbol, side, quantity, price=None, leverage=DEFAULT_LEVERAGE):
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=ORDER_WORKERS + GUNICORN_THREADS,
+))
+
+_WEBHOOK_HMAC = hmac.new(WEBHOOK_SECRET.encode(), digestmod="sha256") if WEBHOOK_SECRET else None
+
+EXECUTOR = ThreadPoolExecutor(max_workers=ORDER_WORKERS, thread_name_prefix="order")
+
+_exchange = None
+_exchange_lock = threading.Lock()
+_markets_loaded_at = None
+_markets_attempted_at = None
+MARKETS_RETRY_DELAY = 30
+SWAP_INDEX = {}
+SYMBOL_LOOKUP = {}
+PRECISION = {}
+_LEVERAGE_CACHE = {}
+_balance_lock = threading.Lock()
+_balance_cached = None
+_balance_generation = 0
+_ticker_cache = {}
+DEDUP_TTL = 60
+DEDUP_HASH_TTL = 5
+DEDUP_MAX_SIZE = 4096
+_recent_alerts = {}
+_recent_alerts_lock = threading.Lock()
+
+DEFAULT_STEP = Decimal("0.000001")
+
+def _step(value):
+    return Decimal(str(value)) if value else DEFAULT_STEP
+
+def quantize(value, step):
+    return float((Decimal(str(value)) // step) * step)
+
+class OrderSubmitError(RuntimeError):
+    pass
+
+class CircuitOpenError(Exception):
+    def __init__(self, breaker):
+        super().__init__(f"MEXC {breaker.name} devresi açık")
+        self.breaker = breaker
+
+class CircuitBreaker:
+    def __init__(self, name, threshold, cooldown):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._last_failure = 0.0
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        with self._lock:
+            return self._failures >= self.threshold and time.monotonic() - self._last_failure < self.cooldown
+
+    def retry_after(self):
+        with self._lock:
+            return max(1, int(self.cooldown - (time.monotonic() - self._last_failure)) + 1)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._last_failure = time.monotonic()
+            if self._failures == self.threshold:
+                logger.warning("[BREAKER] MEXC %s devresi %ss için açıldı", self.name, self.cooldown)
+
+BREAKERS = {
+    name: CircuitBreaker(name, threshold=5, cooldown=30)
+    for name in ("order", "balance", "ticker", "leverage")
+}
+
+def _retry_after(fn):
+    headers = getattr(getattr(fn, "__self__", None), "last_response_headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def call_with_retry(fn, *args, breaker, retries=3, base_delay=0.2, max_delay=4.0, deadline=8.0, **kwargs):
+    if breaker.is_open():
+        raise CircuitOpenError(breaker)
+    started = time.monotonic()
+    for attempt in range(retries):
+        try:
+            result = fn(*args, **kwargs)
+        except ccxt.NetworkError as e:
+            retry_after = _retry_after(fn) if isinstance(e, ccxt.RateLimitExceeded) else None
+            delay = min(max_delay, base_delay * 2 ** attempt) * (0.5 + random.random() / 2)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if (attempt == retries - 1 or delay > max_delay
+                    or time.monotonic() - started + delay > deadline):
+                breaker.record_failure()
+                raise
+            logger.warning("[RETRY] %s başarısız (deneme %d/%d), %.2fs sonra tekrar: %s",
+                           getattr(fn, "__name__", fn), attempt + 1, retries, delay, e)
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+def _markets_stale():
+    return _markets_loaded_at is None or time.monotonic() - _markets_loaded_at > MARKETS_TTL
+
+def _build_symbol_lookup(swap_index):
+    lookup = {}
+    for (base, quote), entry in swap_index.items():
+        unified_symbol, market_id = entry
+        for key in (unified_symbol, market_id, base + quote, f"{base}/{quote}", f"{base}{quote}.P"):
+            lookup[key.upper()] = entry
+    for (base, quote), entry in swap_index.items():
+        lookup.setdefault(base.upper(), entry)
+    return lookup
+
+def _markets_refresh_due():
+    return _markets_attempted_at is None or time.monotonic() - _markets_attempted_at > MARKETS_RETRY_DELAY
+
+def _load_markets():
+    global _markets_loaded_at, _markets_attempted_at, SWAP_INDEX, SYMBOL_LOOKUP, PRECISION
+    _markets_attempted_at = time.monotonic()
+    _exchange.load_markets(reload=True)
+    usdt_swaps = {
+        s: m for s, m in _exchange.markets.items()
+        if m.get('type') == 'swap' and m.get('settle') == 'USDT'
+    }
+    swap_index = {(m['base'], m['quote']): (s, m['id']) for s, m in usdt_swaps.items()}
+    precision = {
+        s: (_step(m['precision'].get('amount')), _step(m['precision'].get('price')))
+        for s, m in usdt_swaps.items()
+    }
+    PRECISION, SWAP_INDEX, SYMBOL_LOOKUP = precision, swap_index, _build_symbol_lookup(swap_index)
+    _markets_loaded_at = time.monotonic()
+    logger.info("[MARKETS] %d swap sembol yüklendi.", len(SWAP_INDEX))
+
+def _refresh_markets():
+    if not _exchange_lock.acquire(blocking=False):
+        return
+    try:
+        if _markets_stale():
+            _load_markets()
+    except Exception as e:
+        logger.warning("[MARKETS] Yenileme başarısız: %s", e)
+    finally:
+        _exchange_lock.release()
+
+def get_exchange():
+    global _exchange
+    if _markets_loaded_at is not None:
+        if _markets_stale() and _markets_refresh_due() and not _exchange_lock.locked():
+            threading.Thread(target=_refresh_markets, name="markets-refresh", daemon=True).start()
+        return _exchange
+
+    with _exchange_lock:
+        if _exchange is None:
+            exchange = ccxt.mexc({
+                "apiKey": MEXC_API_KEY,
+                "secret": MEXC_API_SECRET,
+                "enableRateLimit": True,
+                "timeout": EXCHANGE_TIMEOUT_MS,
+                "session": SESSION,
+            })
+            if USE_TESTNET:
+                exchange.set_sandbox_mode(True)
+            _exchange = exchange
+
+        if _markets_loaded_at is None:
+            _load_markets()
+
+        return _exchange
+
+def warm_up():
+    try:
+        get_exchange()
+    except Exception as e:
+        logger.warning("[MARKETS] Ön yükleme başarısız: %s", e)
+
+def start_warm_up():
+    threading.Thread(target=warm_up, name="markets-warmup", daemon=True).start()
+
+def normalize_symbol(symbol):
+    key = symbol.strip().upper()
+    unified_symbol, market_id = SYMBOL_LOOKUP.get(key, (None, None))
+    if unified_symbol is None:
+        raise ValueError(f"[SYMBOL] Sembol bulunamadı: {key}")
+
+    logger.info("[SYMBOL] Kullanılan sembol: %s (%s)", unified_symbol, market_id)
+    return unified_symbol
+
+def get_usdt_balance(exchange):
+    global _balance_cached
+    with _balance_lock:
+        cached = _balance_cached
+        if cached is not None and cached[2] == _balance_generation and time.monotonic() - cached[1] < BALANCE_TTL:
+            return cached[0]
+
+        generation = _balance_generation
+        response = call_with_retry(
+            exchange.contract_private_get_account_asset_currency, {"currency": "USDT"},
+            breaker=BREAKERS["balance"]
+        )
+        data = response.get("data") or {}
+        value = float(data.get("availableBalance") or 0)
+        _balance_cached = (value, time.monotonic(), generation)
+        return value
+
+def invalidate_usdt_balance():
+    global _balance_generation
+    _balance_generation += 1
+
+Alert = namedtuple("Alert", ["symbol", "side", "entry_price"])
+
+def parse_alert(data):
+    if not data or not isinstance(data, dict):
+        raise ValueError("Geçersiz veya boş JSON")
+
+    symbol = data.get("symbol")
+    side = data.get("side")
+    if not isinstance(symbol, str) or not isinstance(side, str) or not symbol or not side:
+        raise ValueError("Eksik parametreler: symbol veya side")
+
+    side = side.strip().lower()
+    if side not in ("long", "short"):
+        raise ValueError("Geçersiz side: long veya short olmalı")
+
+    entry_price = data.get("entry_price")
+    if entry_price is not None:
+        if isinstance(entry_price, bool) or not isinstance(entry_price, (str, int, float)):
+            raise ValueError("Geçersiz entry_price")
+        try:
+            entry_price = float(entry_price)
+        except (TypeError, ValueError):
+            raise ValueError("Geçersiz entry_price")
+        if not 0 < entry_price < float("inf"):
+            raise ValueError("Geçersiz entry_price")
+
+    return Alert(symbol, side, entry_price)
+
+def claim_alert(key, ttl):
+    now = time.monotonic()
+    with _recent_alerts_lock:
+        while _recent_alerts:
+            oldest_key, expires_at = next(iter(_recent_alerts.items()))
+            if expires_at > now and len(_recent_alerts) < DEDUP_MAX_SIZE:
+                break
+            del _recent_alerts[oldest_key]
+
+        if _recent_alerts.get(key, 0) > now:
+            return False
+        _recent_alerts.pop(key, None)
+        _recent_alerts[key] = now + ttl
+        return True
+
+def release_alert(key):
+    with _recent_alerts_lock:
+        _recent_alerts.pop(key, None)
+
+def verify_signature(body, signature):
+    if _WEBHOOK_HMAC is None:
+        return True
+    if not signature:
+        return False
+    mac = _WEBHOOK_HMAC.copy()
+    mac.update(body)
+    return hmac.compare_digest(mac.hexdigest().encode(), signature.strip().lower().encode("latin-1"))
+
+def get_last_price(exchange, normalized_symbol):
+    cached = _ticker_cache.get(normalized_symbol)
+    if cached is not None and time.monotonic() - cached[1] < TICKER_TTL:
+        return cached[0]
+
+    ticker = call_with_retry(exchange.fetch_ticker, normalized_symbol, breaker=BREAKERS["ticker"])
+    _ticker_cache[normalized_symbol] = (ticker['last'], time.monotonic())
+    return ticker['last']
+
+def _alert_id(data):
+    alert_id = data.get("alert_id")
+    if not alert_id:
+        return None
+    alert_id = str(alert_id)
+    if len(alert_id) > 32:
+        return hashlib.blake2s(alert_id.encode(), digest_size=16).hexdigest()
+    return alert_id
+
+def alert_key_for(data):
+    alert_id = _alert_id(data)
+    if alert_id:
+        return alert_id
+    payload = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2s(payload, digest_size=16).hexdigest()
+
+def client_order_id_for(data):
+    return _alert_id(data) or secrets.token_hex(16)
+
+def _set_leverage(exchange, normalized_symbol, position_type, leverage):
+    call_with_retry(exchange.set_leverage, leverage, normalized_symbol, {
+        "openType": 1,
+        "positionType": position_type
+    }, breaker=BREAKERS["leverage"])
+    _LEVERAGE_CACHE[(normalized_symbol, position_type)] = leverage
+    logger.info("[LEVERAGE] %s için kaldıraç %sx olarak ayarlandı", normalized_symbol, leverage)
+
+SIDES = {
+    "long": ("buy", 1),
+    "short": ("sell", 2),
+}
+
+def place_mexc_futures_order(exchange, normalized_symbol, side, quantity, price=None, leverage=DEFAULT_LEVERAGE, client_order_id=None):
+    submitted = False
     try:
-        exchange.set_leverage(leverage, normalized_symbol, {
-            "openType": 1,
-            "positionType": 1 if side.lower() == "long" else 2
-        })
+        side_value, position_type = SIDES[side.lower()]
+        if _LEVERAGE_CACHE.get((normalized_symbol, position_type)) != leverage:
+            _set_leverage(exchange, normalized_symbol, position_type, leverage)
+
+        amount_step, price_step = PRECISION[normalized_symbol]
+        quantity = quantize(quantity, amount_step)
+        if price is not None:
+            price = quantize(price, price_step)
 
         order_type = 'market' if price is None else 'limit'
-        side_value = 'buy' if side.lower() == 'long' else 'sell'
 
-        order = exchange.create_order(
+        params = {}
+        if client_order_id is not None:
+            params["clientOrderId"] = client_order_id
+
+        submitted = True
+        order = call_with_retry(
+            exchange.create_order,
             symbol=normalized_symbol,
             type=order_type,
             side=side_value,
             amount=quantity,
             price=price,
-            params={"type": "swap"}
+            params=params,
+            breaker=BREAKERS["order"],
+            retries=3 if client_order_id is not None else 1
         )
 
-        logger.info(f"[CCXT ORDER] Emir başarıyla gönderildi: {order}")
+        invalidate_usdt_balance()
+        logger.info("[CCXT ORDER] Emir başarıyla gönderildi: %s", order.get("id"))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[CCXT ORDER] Emir detayı: %s", order)
         return order
 
+    except CircuitOpenError:
+        raise
     except Exception as e:
-        logger.error(f"[CCXT ORDER] Emir gönderilirken hata oluştu: {e}")
-        raise RuntimeError(f"Emir gönderilemedi: {str(e)}")
+        logger.error("[CCXT ORDER] Emir gönderilirken hata oluştu: %s", e)
+        error = OrderSubmitError if submitted else RuntimeError
+        raise error(f"Emir gönderilemedi: {str(e)}")
+
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+app.config["MAX_CONTENT_LENGTH"] = MAX_BODY_BYTES
+
+def circuit_open_response(breaker):
+    response = jsonify({"error": "MEXC geçici olarak erişilemiyor, daha sonra tekrar deneyin"})
+    response.headers["Retry-After"] = str(breaker.retry_after())
+    return response, 503
 
 @app.route("/health", methods=["GET"])
 def health():
     return "OK", 200
 
-@app.route("/webhook", methods=["POST"])
-def mexc_webhook():
-    try:
-        data = request.get_json(force=True)
-        if not data:
-            return jsonify({"error": "Geçersiz veya boş JSON"}), 400
+def open_position(symbol, side, entry_price, client_order_id):
+    breakers = ("order", "balance") if entry_price is not None else ("order", "balance", "ticker")
+    for name in breakers:
+        if BREAKERS[name].is_open():
+            return circuit_open_response(BREAKERS[name])
 
-        logger.info(f"[WEBHOOK] Gelen veri: {data}")
+    exchange = get_exchange()
 
-        symbol = data.get("symbol")
-        side = data.get("side")
-        entry_price = data.get("entry_price")
+    try:
+        normalized_symbol = normalize_symbol(symbol)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
 
-        if not symbol or not side:
-            return jsonify({"error": "Eksik parametreler: symbol veya side"}), 400
+    balance_future = EXECUTOR.submit(get_usdt_balance, exchange)
+    price_future = None
+    if entry_price is None:
+        price_future = EXECUTOR.submit(get_last_price, exchange, normalized_symbol)
 
-        exchange = ccxt.mexc({
-            "apiKey": MEXC_API_KEY,
-            "secret": MEXC_API_SECRET,
-            "enableRateLimit": True,
-        })
-        if USE_TESTNET:
-            exchange.set_sandbox_mode(True)
+    usdt_balance = balance_future.result()
+    logger.info("[BAKIYE] USDT Vadeli Bakiye: %s", usdt_balance)
 
-        exchange.load_markets()
+    if usdt_balance <= 0:
+        return jsonify({"status": "failed", "message": "Yeterli bakiye yok"}), 400
 
-        try:
-            normalized_symbol = normalize_symbol(symbol, exchange)
-        except ValueError as ve:
-            return jsonify({"error": str(ve)}), 400
+    current_price = entry_price if price_future is None else price_future.result()
 
-        balance = exchange.fetch_balance({"type": "swap"})
-        usdt_balance = balance['free'].get('USDT', 0)
-        logger.info(f"[BAKIYE] USDT Vadeli Bakiye: {usdt_balance}")
+    amount_step, _ = PRECISION[normalized_symbol]
+    quantity = quantize((usdt_balance * DEFAULT_LEVERAGE) / current_price, amount_step)
+    MIN_ORDER_QUANTITY = 1.0
+    if quantity < MIN_ORDER_QUANTITY:
+        return jsonify({
+            "status": "failed",
+            "message": f"Minimum emir miktarının altında ({quantity:.6f} < {MIN_ORDER_QUANTITY})"
+        }), 400
 
-        if usdt_balance <= 0:
-            return jsonify({"status": "failed", "message": "Yeterli bakiye yok"}), 400
+    result = place_mexc_futures_order(
+        exchange, normalized_symbol, side, quantity, price=None,
+        client_order_id=client_order_id
+    )
+    return jsonify({"status": "success", "message": f"{side} emir gönderildi", "order": result}), 200
 
-        ticker = exchange.fetch_ticker(normalized_symbol)
-        current_price = ticker['last']
+@app.route("/webhook", methods=["POST"])
+def mexc_webhook():
+    alert_key = None
+    try:
+        if not verify_signature(request.get_data(), request.headers.get("X-Webhook-Signature")):
+            return jsonify({"error": "Geçersiz imza"}), 401
 
-        quantity = (usdt_balance * DEFAULT_LEVERAGE) / current_price
-        MIN_ORDER_QUANTITY = 1.0
-        if quantity < MIN_ORDER_QUANTITY:
-            return jsonify({
-                "status": "failed",
-                "message": f"Minimum emir miktarının altında ({quantity:.6f} < {MIN_ORDER_QUANTITY})"
-            }), 400
+        data = request.get_json(force=True, silent=True, cache=False)
+        logger.info("[WEBHOOK] Gelen veri: %s", data)
+
+        try:
+            alert = parse_alert(data)
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
 
-        quantity = float(f"{quantity:.6f}")
+        alert_key = alert_key_for(data)
+        if not claim_alert(alert_key, DEDUP_TTL if data.get("alert_id") else DEDUP_HASH_TTL):
+            logger.info("[WEBHOOK] Tekrarlanan alert yok sayıldı: %s", alert_key)
+            return jsonify({"status": "duplicate", "message": "Bu alert zaten işlendi"}), 200
 
-        result = place_mexc_futures_order(exchange, normalized_symbol, side.lower(), quantity, price=None)
-        return jsonify({"status": "success", "message": f"{side} emir gönderildi", "order": result}), 200
+        response, status = open_position(alert.symbol, alert.side, alert.entry_price, client_order_id_for(data))
+        if status != 200:
+            release_alert(alert_key)
+        return response, status
 
+    except HTTPException:
+        raise
+    except CircuitOpenError as e:
+        release_alert(alert_key)
+        logger.warning("[WEBHOOK] %s", e)
+        return circuit_open_response(e.breaker)
     except Exception as e:
-        logger.error(f"[WEBHOOK] Hata: {e}\n{traceback.format_exc()}")
-        return jsonify({"error": str(e)}), 500
+        if alert_key is not None and not isinstance(e, OrderSubmitError):
+            release_alert(alert_key)
+        error_id = secrets.token_hex(6)
+        logger.exception("[WEBHOOK] Hata (%s): %s", error_id, e)
+        return jsonify({"error": "Sunucu hatası", "error_id": error_id}), 500
 
 if __name__ == "__main__":
     logger.info("Sunucu başlıyor...")
@@ -0,0 +1,20 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MEXC_API_KEY = os.getenv("MEXC_API_KEY")
+MEXC_API_SECRET = os.getenv("MEXC_API_SECRET")
+USE_TESTNET = os.getenv("USE_TESTNET", "False").lower() in ("true", "1", "yes")
+DEFAULT_LEVERAGE = int(os.getenv("LEVERAGE", "25"))
+MARKETS_TTL = float(os.getenv("MARKETS_TTL", "21600"))
+BALANCE_TTL = float(os.getenv("BALANCE_TTL", "3"))
+TICKER_TTL = float(os.getenv("TICKER_TTL", "1"))
+EXCHANGE_TIMEOUT_MS = int(os.getenv("EXCHANGE_TIMEOUT_MS", "3000"))
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", "8"))
+ORDER_WORKERS = int(os.getenv("ORDER_WORKERS", str(2 * GUNICORN_THREADS)))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", "4096"))
+
+if not MEXC_API_KEY or not MEXC_API_SECRET:
+    raise RuntimeError("MEXC_API_KEY veya MEXC_API_SECRET eksik")
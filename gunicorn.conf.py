@@ -0,0 +1,13 @@
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = 60
+keepalive = 30
+preload_app = False
+
+def post_worker_init(worker):
+    from app import start_warm_up
+    start_warm_up()